@@ -5,62 +5,130 @@
 #
 #---------------------------------------------------------------------------
 
-import optparse, sys, random
+import optparse, sys, random, zlib
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby
 from math import log2
 
+# Imported by use_jit, so that ordinary runs don't pay for loading them.
+numba = numpy = None
+
 class SudokuError(ValueError):
   pass
 
-alphabet = ('1', '2', '3', '4', '5', '6', '7', '8', '9')
+# Sets of symbols are represented as bit masks, with bit n set
+# if symbol n is a member. Symbols are the integers 1 to 9.
+all_symbols = 0x3fe
 
-divider = "+---" * 3 + "+"
+# Lookup tables indexed by mask: the symbols in it, in ascending
+# order, and how many there are.
+mask_symbols = tuple(tuple(symbol for symbol in range(1, 10) if mask & (1 << symbol))
+  for mask in range(all_symbols + 1))
+symbol_count = tuple(len(symbols) for symbols in mask_symbols)
 
-def hash_row(row):
-  return sum(i * ord(c) for i, c in enumerate(row))
+# A grid is a bytearray of 81 cells in row-major order. Cells hold
+# 0 if empty, 1 to 9 for a symbol, or (transiently, when debugging
+# puzzlify) 10 for the cell under consideration.
+empty = 0
+marked = 10
+cell_chars = " 123456789*"
 
-def hash_rows(rows):
-  return sum(i * hash_row(row) for i, row in enumerate(rows))
+divider = "+---" * 3 + "+"
+
+# Messages are packed into and out of one big integer. Combining
+# halves of equal size, rather than one digit at a time, keeps this
+# from taking time quadratic in the message length.
+
+def mixed_radix_value(chunks, lo = 0, hi = None):
+  # Value of the (radix, digit) pairs chunks[lo:hi], most significant
+  # first, together with the product of their radices.
+  if hi is None:
+    hi = len(chunks)
+  if hi - lo <= 16:
+    value = 0
+    radix = 1
+    for m, digit in chunks[lo:hi]:
+      value = value * m + digit
+      radix *= m
+    return value, radix
+  mid = (lo + hi) // 2
+  hi_value, hi_radix = mixed_radix_value(chunks, lo, mid)
+  lo_value, lo_radix = mixed_radix_value(chunks, mid, hi)
+  return hi_value * lo_radix + lo_value, hi_radix * lo_radix
+
+def split_chars(bits, count, chars):
+  # Append the count 7-bit characters of bits to chars, most
+  # significant first.
+  if count <= 16:
+    for i in reversed(range(count)):
+      chars.append(chr((bits >> (7 * i)) & 0x7f))
+  else:
+    half = count // 2
+    split_chars(bits >> (7 * half), count - half, chars)
+    split_chars(bits & ((1 << (7 * half)) - 1), half, chars)
 
 def print_info(*args, **kwds):
   print(file = sys.stderr, *args, **kwds)
 
-def format(rows):
-  result = []
-  for r, row in enumerate(rows):
+# A formatted grid is built by copying runs of three cells into
+# a blank layout. Each run is given by its first cell number and
+# its offset into the layout, which has 14 characters per line
+# including the newline.
+
+def blank_layout():
+  lines = []
+  for r in range(9):
     if r % 3 == 0:
-      result.append(divider)
-    line = "".join(row)
-    result.append("|%s|%s|%s|" % (line[:3], line[3:6], line[6:]))
-  result.append(divider)
-  return "\n".join(result)
+      lines.append(divider)
+    lines.append("|   |   |   |")
+  lines.append(divider)
+  return "\n".join(lines).encode("ascii")
+
+grid_layout = blank_layout()
+cell_runs = tuple((r * 9 + 3 * j, (r + r // 3 + 1) * 14 + 1 + 4 * j)
+  for r in range(9) for j in range(3))
+cell_table = bytes.maketrans(bytes(range(len(cell_chars))), cell_chars.encode("ascii"))
+
+def format(grid):
+  chars = grid.translate(cell_table)
+  result = bytearray(grid_layout)
+  for n, offset in cell_runs:
+    result[offset:offset + 3] = chars[n:n + 3]
+  return result.decode("ascii")
+
+# Characters allowed in the text of a grid, and the translation
+# from digit characters to cell values.
+digit_chars = b"123456789"
+layout_chars = b"+-|\n"
+digit_table = bytes.maketrans(digit_chars, bytes(range(1, 10)))
 
 def unformat(text):
-  chars = []
-  for c in text:
-    if "1" <= c <= "9":
-      chars.append(c)
-    elif c in "+-|\n":
-      pass
-    elif c == ' ':
-      raise SudokuError("Unsolved sudoku grid (must be solved before decoding)")
-    else:
-      raise SudokuError("Invalid character %r in sudoku grid" % c)
-  if len(chars) != 81:
+  bad = None
+  try:
+    data = text.encode("ascii")
+  except UnicodeEncodeError as e:
+    data = text[:e.start].encode("ascii")
+    bad = text[e.start]
+  data = data.translate(None, layout_chars)
+  rest = data.translate(None, digit_chars)
+  if rest:
+    bad = chr(rest[0])
+  if bad == ' ':
+    raise SudokuError("Unsolved sudoku grid (must be solved before decoding)")
+  elif bad is not None:
+    raise SudokuError("Invalid character %r in sudoku grid" % bad)
+  if len(data) != 81:
     raise SudokuError("Wrong number of digits in sudoku grid")
-  return [chars[i:i+9] for i in range(0, 81, 9)]
+  return bytearray(data.translate(digit_table))
 
-def read_grid(f):
-  lines = []
-  while True:
-    line = f.readline().strip()
-    if not line:
-      break
-    lines.append(line)
-  if lines:
-    return unformat("".join(lines))
+def read_grids(f):
+  # Grids are separated by one or more blank lines.
+  for nonblank, lines in groupby(map(str.strip, f), key = bool):
+    if nonblank:
+      yield unformat("".join(lines))
 
-def dump(rows):
-  print_info(format(rows))
+def dump(grid):
+  print_info(format(grid))
 
 def square_containing_cell(r, c):
   return (r // 3) * 3 + c // 3
@@ -72,11 +140,121 @@ def cell_indices(n):
 
 def cells_in_same_square(r, c):
   r0 = r - (r % 3)
-  c0 = c = (c % 3)
+  c0 = c - (c % 3)
   for r1 in range(r0, r0 + 3):
     for c1 in range(c0, c0 + 3):
       yield (r1, c1)
 
+def later_peers(n):
+  # Cells after cell n sharing a row, column or square with it.
+  r, c, s, = cell_indices(n)
+  for n1 in range(n + 1, 81):
+    r1, c1, s1, = cell_indices(n1)
+    if r1 == r or c1 == c or s1 == s:
+      yield (r1, c1, s1)
+
+# Lookup tables to keep index arithmetic out of the inner loops.
+# Cells are numbered 0 to 80 in row-major order.
+cell_index_table = tuple(cell_indices(n) for n in range(81))
+square_cell_table = tuple(tuple(cells_in_same_square(r, c))
+  for r in range(0, 9, 3) for c in range(0, 9, 3))
+
+# Later peers of all cells in one flat tuple, those of cell n
+# starting at later_peer_start[n]. Kept flat so that a compiled
+# solver can treat them as constant arrays.
+def flatten_later_peers():
+  cells = []
+  start = [0]
+  for n in range(81):
+    cells.extend(later_peers(n))
+    start.append(len(cells))
+  return tuple(cells), tuple(start)
+
+later_peer_cells, later_peer_start = flatten_later_peers()
+
+def solution_exists(n, row_avail, col_avail, sqr_avail):
+  # Determine whether cells n onwards can be filled given the
+  # availability masks, which are restored before returning.
+  # The search is depth-first, using an explicit stack: for each
+  # cell, the symbols not yet tried there and the one placed there.
+  untried = [0] * 81
+  placed = [0] * 81
+  k = n
+  if k < 81:
+    r, c, s, = cell_index_table[k]
+    untried[k] = row_avail[r] & col_avail[c] & sqr_avail[s]
+  while n <= k < 81:
+    r, c, s, = cell_index_table[k]
+    bit = placed[k]
+    if bit:
+      row_avail[r] ^= bit
+      col_avail[c] ^= bit
+      sqr_avail[s] ^= bit
+      placed[k] = 0
+    avail = untried[k]
+    if avail == 0:
+      k -= 1
+      continue
+    bit = avail & -avail
+    untried[k] = avail ^ bit
+    row_avail[r] ^= bit
+    col_avail[c] ^= bit
+    sqr_avail[s] ^= bit
+    placed[k] = bit
+    # Forward check: abandon this symbol without searching
+    # further if it leaves a later cell with no symbols.
+    blocked = False
+    for i in range(later_peer_start[k], later_peer_start[k + 1]):
+      r1, c1, s1, = later_peer_cells[i]
+      if row_avail[r1] & col_avail[c1] & sqr_avail[s1] == 0:
+        blocked = True
+        break
+    if not blocked:
+      k += 1
+      if k < 81:
+        r, c, s, = cell_index_table[k]
+        untried[k] = row_avail[r] & col_avail[c] & sqr_avail[s]
+  success = k == 81
+  for k in range(n, 81):
+    bit = placed[k]
+    if bit:
+      r, c, s, = cell_index_table[k]
+      row_avail[r] ^= bit
+      col_avail[c] ^= bit
+      sqr_avail[s] ^= bit
+  return success
+
+def use_jit():
+  # Replace solution_exists with a version compiled by numba. The
+  # compiled code is cached on disk, so only the first run pays
+  # for compilation.
+  global solution_exists, numba, numpy
+  try:
+    import numba, numpy
+  except ImportError:
+    raise SudokuError("The numba package is required for --jit")
+  if not hasattr(solution_exists, "py_func"):
+    solution_exists = numba.njit(cache = True)(solution_exists)
+
+def call_solver(n, row_avail, col_avail, sqr_avail, jit = False):
+  if jit:
+    row_avail = numpy.array(row_avail, dtype = numpy.int64)
+    col_avail = numpy.array(col_avail, dtype = numpy.int64)
+    sqr_avail = numpy.array(sqr_avail, dtype = numpy.int64)
+  return solution_exists(n, row_avail, col_avail, sqr_avail)
+
+def grid_valid(grid):
+  # True if every row, column and square of a filled-in grid
+  # contains all nine symbols.
+  masks = [0] * 27
+  for n in range(81):
+    r, c, s, = cell_index_table[n]
+    bit = 1 << grid[n]
+    masks[r] |= bit
+    masks[9 + c] |= bit
+    masks[18 + s] |= bit
+  return all(mask == all_symbols for mask in masks)
+
 class Stats:
 
   def __init__(self):
@@ -90,82 +268,166 @@ class Stats:
 class Coder:
 
   debug = False
+  jit = False
+  processes = 1
+  cache_size = 10000
 
   def __init__(self, options = None, stats = None):
     self.stats = stats
+    self.candidate_cache = {}
+    self.feasibility_cache = {}
+    self.pool = None
     if options:
       self.debug = getattr(options, "debug", False)
       self.puzzle_mode = getattr(options, "puzzle_mode", False)
-  
-  def alphabet_sets(self):
-    return [set(alphabet) for i in range(9)]
+      self.jit = getattr(options, "jit", False)
+      self.processes = getattr(options, "processes", None) or 1
+    if self.jit:
+      use_jit()
+
+  def get_pool(self):
+    if not self.pool:
+      self.pool = ProcessPoolExecutor(self.processes,
+        initializer = use_jit if self.jit else None)
+    return self.pool
+
+  def close(self):
+    if self.pool:
+      self.pool.shutdown()
+      self.pool = None
   
   def init_block(self):
-    aset = self.alphabet_sets
-    self.row_avail_sets = aset()
-    self.col_avail_sets = aset()
-    self.sqr_avail_sets = aset()
+    self.row_avail = [all_symbols] * 9
+    self.col_avail = [all_symbols] * 9
+    self.sqr_avail = [all_symbols] * 9
 
   def dprint(self, *args, **kwds):
     if self.debug:
       print_info(*args, **kwds)
 
   def available_symbols(self, r, c, s):
-    row_avail = self.row_avail_sets[r]
-    col_avail = self.col_avail_sets[c]
-    sqr_avail = self.sqr_avail_sets[s]
-    return row_avail & col_avail & sqr_avail
+    return self.row_avail[r] & self.col_avail[c] & self.sqr_avail[s]
 
   def use_symbol(self, r, c, s, symbol):
-    self.row_avail_sets[r].remove(symbol)
-    self.col_avail_sets[c].remove(symbol)
-    self.sqr_avail_sets[s].remove(symbol)
+    bit = 1 << symbol
+    self.row_avail[r] ^= bit
+    self.col_avail[c] ^= bit
+    self.sqr_avail[s] ^= bit
   
-  def unuse_symbol(self, r, c, s, symbol):
-    self.row_avail_sets[r].add(symbol)
-    self.col_avail_sets[c].add(symbol)
-    self.sqr_avail_sets[s].add(symbol)
-
-  def find_candidate_list(self, n):
-    r, c, s, = cell_indices(n)
-    candidate_set = set()
-    for symbol in self.available_symbols(r, c, s):
+  # Symbols are toggled in and out of the masks, so undoing
+  # a use is the same operation.
+  unuse_symbol = use_symbol
+
+  def state_key(self, n):
+    # Whether the rest of the grid from cell n onwards can be filled
+    # depends only on n and the availability masks, so results are
+    # cached under these, and remain valid from one block to the next.
+    return (n, tuple(self.row_avail), tuple(self.col_avail), tuple(self.sqr_avail))
+
+  def cache_result(self, cache, key, result):
+    if len(cache) >= self.cache_size:
+      del cache[next(iter(cache))]
+    cache[key] = result
+    return result
+
+  def find_candidate_mask(self, n, known = 0):
+    # The grid filled so far always has a completion, so if only one
+    # symbol is available here, it must be the one. When decoding, the
+    # symbol in the grid being decoded is known to be feasible too.
+    r, c, s, = cell_index_table[n]
+    avail = self.available_symbols(r, c, s)
+    if symbol_count[avail] == 1:
+      return avail
+    key = self.state_key(n)
+    candidates = self.candidate_cache.get(key)
+    if candidates is None:
+      candidates = self.cache_result(self.candidate_cache, key,
+        self.search_candidate_mask(n, known))
+    return candidates
+
+  def search_candidate_mask(self, n, known = 0):
+    r, c, s, = cell_index_table[n]
+    # Symbols not yet placed anywhere are interchangeable: swapping
+    # two of them throughout a solution gives another solution that
+    # agrees with the cells filled so far. So if one of them can go
+    # in this cell, they all can, and only one needs to be tried.
+    fresh = all_symbols
+    for mask in self.row_avail:
+      fresh &= mask
+    avail = self.available_symbols(r, c, s)
+    candidates = 0
+    if known:
+      candidates = 1 << known
+      if candidates & fresh:
+        candidates |= avail & fresh
+    untested = avail & ~candidates
+    tested = mask_symbols[untested & ~fresh] + mask_symbols[untested & fresh][:1]
+    for symbol, success in zip(tested, self.symbols_feasible(n, tested)):
+      if success:
+        candidates |= 1 << symbol
+        if candidates & fresh:
+          candidates |= avail & fresh
+    return candidates
+
+  def symbols_feasible(self, n, symbols):
+    # For each symbol, whether the grid can be completed with it in
+    # cell n. The checks are independent, so those not answered from
+    # the cache are shared out among worker processes if enabled.
+    r, c, s, = cell_index_table[n]
+    results = []
+    pending = []
+    for symbol in symbols:
       self.dprint("considering", symbol)
       self.use_symbol(r, c, s, symbol)
-      if self.solution_exists(n + 1):
-        candidate_set.add(symbol)
+      if self.peers_blocked(n):
+        success = False
+      else:
+        key = self.state_key(n + 1)
+        success = self.feasibility_cache.get(key)
+      if success is None:
+        if self.processes > 1:
+          success = self.get_pool().submit(call_solver, n + 1,
+            list(self.row_avail), list(self.col_avail), list(self.sqr_avail), self.jit)
+          pending.append((len(results), key))
+        else:
+          success = self.cache_result(self.feasibility_cache, key,
+            self.solution_exists(n + 1))
+      results.append(success)
       self.unuse_symbol(r, c, s, symbol)
-    return sorted(candidate_set)
+    for i, key in pending:
+      results[i] = self.cache_result(self.feasibility_cache, key, results[i].result())
+    return results
+
+  def peers_blocked(self, n):
+    # Forward check after placing a symbol in cell n: true if some
+    # later cell sharing a unit with it has no symbols left, which
+    # rules the symbol out without a search.
+    row_avail = self.row_avail
+    col_avail = self.col_avail
+    sqr_avail = self.sqr_avail
+    for i in range(later_peer_start[n], later_peer_start[n + 1]):
+      r1, c1, s1, = later_peer_cells[i]
+      if row_avail[r1] & col_avail[c1] & sqr_avail[s1] == 0:
+        return True
+    return False
 
   def solution_exists(self, n):
     self.dprint("solution_exists(%s)" % n)
-    if n == 81:
-      self.dprint("found")
-      return True
-    else:
-      r, c, s, = cell_indices(n)
-      avail_set = self.available_symbols(r, c, s)
-      for symbol in avail_set:
-        self.use_symbol(r, c, s, symbol)
-        success = self.solution_exists(n + 1)
-        self.unuse_symbol(r, c, s, symbol)
-        if success:
-          return True
-      return False
+    return call_solver(n, self.row_avail, self.col_avail, self.sqr_avail, self.jit)
 
   def encode_block(self, bits):
     self.dprint("encoding bits: ", bits)
     self.init_block()
-    rows = [[' '] * 9 for i in range(9)]
+    grid = bytearray(81)
     self.chunks = []
     stats = self.stats
     if stats:
       stats.blocks += 1
     for n in range(81):
-      r, c, s, = cell_indices(n)
+      r, c, s, = cell_index_table[n]
       self.dprint("row %s col %s sqr %s" % (r, c, s))
-      candidate_list = self.find_candidate_list(n)
-      m = len(candidate_list)
+      candidates = self.find_candidate_mask(n)
+      m = symbol_count[candidates]
       self.dprint("m =", m)
       if stats:
         e = log2(m)
@@ -176,92 +438,108 @@ class Coder:
       bits, digit = divmod(bits, m)
       self.dprint("bits, digit = %s, %s" % (bits, digit))
       self.chunks.append((m, digit))
-      symbol = candidate_list[digit]
-      rows[r][c] = symbol
+      symbol = mask_symbols[candidates][digit]
+      grid[n] = symbol
       self.use_symbol(r, c, s, symbol)
       if self.debug:
-        dump(rows)
+        dump(grid)
     self.dprint("encoded chunks =", self.chunks)
     if self.puzzle_mode:
-      self.puzzlify(rows)
-    return (rows, bits)
+      self.puzzlify(grid)
+    return (grid, bits)
   
   def single_choice_available(self, r, c, s):
-    return len(self.available_symbols(r, c, s)) == 1
+    return symbol_count[self.available_symbols(r, c, s)] == 1
+
+  # The rule 2 checks OR together the masks of the other empty cells
+  # in the unit, then test the symbol's bit once. The unit's own mask
+  # is common to all of them, so it is applied at the end.
 
-  def row_position_unique(self, rows, r, c, s, symbol):
+  def row_position_unique(self, grid, r, c, s, symbol):
+    col_avail = self.col_avail
+    sqr_avail = self.sqr_avail
+    others = 0
     for c1 in range(9):
-      if c1 != c and rows[r][c1] == ' ':
-        s1 = square_containing_cell(r, c1)
-        avail = self.available_symbols(r, c1, s1)
-        if symbol in avail:
-          self.dprint("%r could also be in row %s at column %s" % (symbol, r, c1))
-          return False
+      if c1 != c and grid[r * 9 + c1] == empty:
+        others |= col_avail[c1] & sqr_avail[cell_index_table[r * 9 + c1][2]]
+    if self.row_avail[r] & others & (1 << symbol):
+      self.dprint("%r could also be elsewhere in row %s" % (symbol, r))
+      return False
     self.dprint("rule 2: no other position in row %s for %r" % (r, symbol))
     return True
 
-  def col_position_unique(self, rows, r, c, s, symbol):
+  def col_position_unique(self, grid, r, c, s, symbol):
+    row_avail = self.row_avail
+    sqr_avail = self.sqr_avail
+    others = 0
     for r1 in range(9):
-      if r1 != r and rows[r1][c] == ' ':
-        s1 = square_containing_cell(r1, c)
-        avail = self.available_symbols(r1, c, s1)
-        if symbol in avail:
-          self.dprint("%r could also be in column %s at row %s" % (symbol, c, r1))
-          return False
+      if r1 != r and grid[r1 * 9 + c] == empty:
+        others |= row_avail[r1] & sqr_avail[cell_index_table[r1 * 9 + c][2]]
+    if self.col_avail[c] & others & (1 << symbol):
+      self.dprint("%r could also be elsewhere in column %s" % (symbol, c))
+      return False
     self.dprint("rule 2: no other position in column %s for %r" % (c, symbol))
     return True
 
-  def sqr_position_unique(self, rows, r, c, s, symbol):
-    for r1, c1 in cells_in_same_square(r, c):
-      if r1 != r and c1 != c and rows[r1][c1] == ' ':
-        avail = self.available_symbols(r1, c1, s)
-        if symbol in avail:
-          self.dprint("%r could also be in square %s at (%s, %s)" % (symbol, s, r1, c1))
-          return False
+  def sqr_position_unique(self, grid, r, c, s, symbol):
+    row_avail = self.row_avail
+    col_avail = self.col_avail
+    others = 0
+    for r1, c1 in square_cell_table[s]:
+      if (r1 != r or c1 != c) and grid[r1 * 9 + c1] == empty:
+        others |= row_avail[r1] & col_avail[c1]
+    if self.sqr_avail[s] & others & (1 << symbol):
+      self.dprint("%r could also be elsewhere in square %s" % (symbol, s))
+      return False
     self.dprint("rule 2: no other position in square %s for %r" % (s, symbol))
     return True
 
-  def puzzlify(self, rows):
+  def puzzlify(self, grid):
     stats = self.stats
-    seed = hash_rows(rows)
-    random.seed(seed)
+    # Seeding from the grid makes the puzzle depend only on the grid.
+    rng = random.Random(zlib.crc32(grid))
     removal_order = list(range(81))
-    random.shuffle(removal_order)
+    rng.shuffle(removal_order)
     for n in removal_order:
-      r, c, s, = cell_indices(n)
-      symbol = rows[r][c]
-      rows[r][c] = '*'
+      r, c, s, = cell_index_table[n]
+      symbol = grid[n]
+      grid[n] = marked
       self.unuse_symbol(r, c, s, symbol)
       if self.debug:
-        dump(rows)
+        dump(grid)
       self.dprint("puzzlify: considering %r at (%s, %s)" % (symbol, r, c))
       if self.single_choice_available(r, c, s):
         self.dprint("rule 1: no other choice")
-        rows[r][c] = ' '
+        grid[n] = empty
         if stats:
           stats.removed1 += 1
       elif (
-          self.row_position_unique(rows, r, c, s, symbol)
-          or self.col_position_unique(rows, r, c, s, symbol)
-          or self.sqr_position_unique(rows, r, c, s, symbol)
+          self.row_position_unique(grid, r, c, s, symbol)
+          or self.col_position_unique(grid, r, c, s, symbol)
+          or self.sqr_position_unique(grid, r, c, s, symbol)
       ):
-        rows[r][c] = ' '
+        grid[n] = empty
         if stats:
           stats.removed2 += 1
       else:
-        rows[r][c] = symbol
+        grid[n] = symbol
         self.use_symbol(r, c, s, symbol)
 
-  def decode_block(self, rows, chunks):
+  def decode_block(self, grid, chunks):
+    # Once the grid is known to be valid, each of its symbols is a
+    # feasible candidate for its cell, and needn't be searched for.
+    if not grid_valid(grid):
+      raise SudokuError("Invalid sudoku grid")
     self.init_block()
     for n in range(81):
-      r, c, s, = cell_indices(n)
+      r, c, s, = cell_index_table[n]
       self.dprint("row %s col %s sqr %s" % (r, c, s))
-      candidate_list = self.find_candidate_list(n)
-      m = len(candidate_list)
+      symbol = grid[n]
+      candidates = self.find_candidate_mask(n, symbol)
+      m = symbol_count[candidates]
       self.dprint("m =", m)
-      symbol = rows[r][c]
-      digit = candidate_list.index(symbol)
+      # The digit is the symbol's rank among the candidates.
+      digit = symbol_count[candidates & ((1 << symbol) - 1)]
       chunks.append((m, digit))
       self.use_symbol(r, c, s, symbol)
     
@@ -270,44 +548,37 @@ class Coder:
     if stats:
       stats.chars = len(message)
       stats.bits = 7 * stats.chars
-    bits = 0
+    codes = []
     for char in message:
       code = ord(char)
       if code > 0x7f:
         raise SudokuError("Non-ASCII character: %r" % char)
-      bits = (bits << 7) | code
+      codes.append((0x80, code))
+    bits, _ = mixed_radix_value(codes)
     while bits:
-      (rows, bits) = self.encode_block(bits)
-      yield rows
+      (grid, bits) = self.encode_block(bits)
+      yield grid
 
   def encode_string(self, message):
     return list(self.iter_encode_string(message))
 
   def decode_string(self, grids):
     chunks = []
-    for rows in grids:
-      self.decode_block(rows, chunks)
-    bits = 0
-    for m, digit in reversed(chunks):
-      bits = bits * m + digit
+    for grid in grids:
+      self.decode_block(grid, chunks)
+    chunks.reverse()
+    bits, _ = mixed_radix_value(chunks)
     chars = []
-    while bits:
-      chars.append(chr(bits & 0x7f));
-      bits >>= 7
-    return "".join(reversed(chars))
+    split_chars(bits, (bits.bit_length() + 6) // 7, chars)
+    return "".join(chars)
 
   def encode_stream(self, fin, fout):
     message = fin.read()
-    for rows in self.iter_encode_string(message):
-      fout.write(format(rows) + "\n\n")
+    for grid in self.iter_encode_string(message):
+      fout.write(format(grid) + "\n\n")
 
   def decode_stream(self, fin, fout):
-    grids = []
-    while True:
-      rows = read_grid(fin)
-      if not rows:
-        break
-      grids.append(rows)
+    grids = list(read_grids(fin))
     message = self.decode_string(grids)
     fout.write(message)
 
@@ -316,8 +587,8 @@ def test(coder):
   print_info("Input message:", repr(s1))
   grids = coder.encode_string(s1)
   print_info("Encoding:")
-  for rows in grids:
-    dump(rows)
+  for grid in grids:
+    dump(grid)
   s2 = coder.decode_string(grids)
   print_info("Decoded message:", repr(s2))
 
@@ -326,7 +597,7 @@ def fail(mess):
   sys.exit(1)
 
 def main():
-  usage = "Usage: %prog (-e [-p] [-s] | -d | -t) [-D] < input > output"
+  usage = "Usage: %prog (-e [-p] [-s] | -d | -t) [-j] [-P n] [-D] < input > output"
   op = optparse.OptionParser(usage = usage)
   op.add_option("-e", "--encode", dest = "mode", action = "store_const", const = "encode",
     help = "read plain text from stdin and write sudoku grids to stdout")
@@ -338,11 +609,21 @@ def main():
     help = "run a brief internal test")
   op.add_option("-s", "--stats", dest = "stats", action = "store_true",
     help = "report encoding statistics")
+  op.add_option("-j", "--jit", dest = "jit", action = "store_true",
+    help = "compile the solver with numba (must be installed)")
+  op.add_option("-P", "--processes", dest = "processes", type = "int", metavar = "n",
+    help = "run solver checks in n parallel processes")
   op.add_option("-D", "--debug", dest = "debug", action = "store_true",
     help = "write debugging information to stderr")
   (options, args) = op.parse_args()
   stats = Stats() if options.stats else None
   coder = Coder(options, stats)
+  try:
+    run(coder, options, stats)
+  finally:
+    coder.close()
+
+def run(coder, options, stats):
   if options.mode == "encode":
     coder.encode_stream(sys.stdin, sys.stdout)
     if stats: